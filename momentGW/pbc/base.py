@@ -49,6 +49,18 @@ class BaseKGW(BaseGW):
         self-consistent scheme.  Default value is `"ia"`.
     compression_tol : float, optional
         Tolerance for the compression.  Default value is `1e-10`.
+    thc_opts : dict, optional
+        Dictionary of options to be used for THC calculations. Current
+        implementation requires a filepath to import the THC integrals.
+    store_full_precision : str, optional
+        Precision of the full (L|pq) array stored when a Fock loop is
+        used, one of `("single", "double")`.  Default value is
+        `"double"`.
+    moment_dtype : type, optional
+        Data type of the intermediate moments in the TDA. Passing
+        `numpy.complex64` halves their memory footprint at the cost of
+        precision, and the self-energy moments are returned in double
+        precision regardless.  Default value is `numpy.complex128`.
     {extra_parameters}
     """
 
@@ -59,9 +71,13 @@ class BaseKGW(BaseGW):
     # --- Extra PBC options
 
     fc = False
+    store_full_precision = "double"
+    moment_dtype = np.complex128
 
     _opts = BaseGW._opts + [
         "fc",
+        "store_full_precision",
+        "moment_dtype",
     ]
 
     def __init__(self, mf, **kwargs):
@@ -116,18 +132,18 @@ class BaseKGW(BaseGW):
 
         gf_occ = self.gf[0].get_occupied()
         gf_occ.remove_uncoupled(tol=1e-1)
+        qpwts = np.sum(np.abs(gf_occ.coupling) ** 2, axis=0)
         for n in range(min(5, gf_occ.naux)):
             en = -gf_occ.energy[-(n + 1)]
-            vn = gf_occ.coupling[:, -(n + 1)]
-            qpwt = np.linalg.norm(vn) ** 2
+            qpwt = qpwts[-(n + 1)]
             logger.note(self, "IP energy level (Γ) %d E = %.16g  QP weight = %0.6g", n, en, qpwt)
 
         gf_vir = self.gf[0].get_virtual()
         gf_vir.remove_uncoupled(tol=1e-1)
+        qpwts = np.sum(np.abs(gf_vir.coupling) ** 2, axis=0)
         for n in range(min(5, gf_vir.naux)):
             en = gf_vir.energy[n]
-            vn = gf_vir.coupling[:, n]
-            qpwt = np.linalg.norm(vn) ** 2
+            qpwt = qpwts[n]
             logger.note(self, "EA energy level (Γ) %d E = %.16g  QP weight = %0.6g", n, en, qpwt)
 
         logger.timer(self, self.name, *cput0)
@@ -160,16 +176,20 @@ class BaseKGW(BaseGW):
             Updated MO energies.
         """
 
-        mo_energy = np.zeros_like(self.mo_energy)
-
+        # Stack the weights and energies, padding to the largest number
+        # of poles with zero weights
+        naux = max(g.naux for g in gf)
+        weights = np.zeros((self.nkpts, self.nmo, naux))
+        energies = np.zeros((self.nkpts, naux))
         for k in self.kpts.loop(1):
-            check = set()
-            for i in range(self.nmo):
-                arg = np.argmax(gf[k].coupling[i] * gf[k].coupling[i].conj())
-                mo_energy[k][i] = gf[k].energy[arg]
-                check.add(arg)
+            weights[k, :, : gf[k].naux] = (gf[k].coupling * gf[k].coupling.conj()).real
+            energies[k, : gf[k].naux] = gf[k].energy
+
+        args = np.argmax(weights, axis=-1)
+        mo_energy = np.take_along_axis(energies, args, axis=-1)
 
-            if len(check) != self.nmo:
+        for k in self.kpts.loop(1):
+            if np.unique(args[k]).size != self.nmo:
                 logger.warn(self, f"Inconsistent quasiparticle weights at k-point {k}!")
 
         return mo_energy
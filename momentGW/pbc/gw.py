@@ -34,6 +34,10 @@ class KGW(BaseKGW, GW):
     def ao2mo(self, transform=True):
         """Get the integrals."""
 
+        # THC integrals are only used for the J and K matrices, and do
+        # not require the DF integrals to be transformed
+        thc = self.polarizability.startswith("thc")
+
         integrals = KIntegrals(
             self.with_df,
             self.kpts,
@@ -42,8 +46,10 @@ class KGW(BaseKGW, GW):
             compression=self.compression,
             compression_tol=self.compression_tol,
             store_full=self.has_fock_loop,
+            store_full_precision=self.store_full_precision,
+            file_path=self.thc_opts.get("file_path", None) if thc else None,
         )
-        if transform:
+        if transform and not thc:
             integrals.transform()
 
         return integrals
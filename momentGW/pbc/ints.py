@@ -2,9 +2,11 @@
 Integral helpers with periodic boundary conditions.
 """
 
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
+import h5py
 import numpy as np
+import scipy.linalg
 from pyscf import lib
 from pyscf.agf2 import mpi_helper
 from pyscf.lib import logger
@@ -13,6 +15,44 @@ from pyscf.pbc import tools
 from momentGW.ints import Integrals
 
 
+def _ao2mo_L(block, ci, cj, half=None):
+    """
+    Transform a block of (L|pq) integrals into the MO basis. Equivalent
+    to `lib.einsum("Lpq,pi,qj->Lij", block, ci.conj(), cj)`, but
+    performed as two matrix multiplications.
+
+    Parameters
+    ----------
+    block : numpy.ndarray
+        Block of integrals, with shape `(naux, nao, nao)`.
+    ci : numpy.ndarray
+        Coefficients for the first index, with shape `(nao, ni)`.
+    cj : numpy.ndarray
+        Coefficients for the second index, with shape `(nao, nj)`.
+    half : numpy.ndarray, optional
+        Result of the first half-transformation `block @ cj`, with
+        shape `(naux * nao, nj)`. If passed, `cj` is ignored. Default
+        value is `None`.
+
+    Returns
+    -------
+    out : numpy.ndarray
+        Transformed block, with shape `(naux, ni, nj)`.
+    """
+
+    naux, nao = block.shape[:2]
+
+    if half is None:
+        half = np.dot(block.reshape(naux * nao, nao), cj)
+    nj = half.shape[-1]
+
+    half = half.reshape(naux, nao, nj).swapaxes(1, 2).reshape(naux * nj, nao)
+    out = np.dot(half, ci.conj())
+    out = out.reshape(naux, nj, -1).swapaxes(1, 2)
+
+    return out
+
+
 class KIntegrals(Integrals):
     """
     Container for the integrals required for KGW methods.
@@ -27,6 +67,8 @@ class KIntegrals(Integrals):
         compression="ia",
         compression_tol=1e-10,
         store_full=False,
+        store_full_precision="double",
+        file_path=None,
     ):
         Integrals.__init__(
             self,
@@ -39,16 +81,110 @@ class KIntegrals(Integrals):
         )
 
         self.kpts = kpts
+        self.file_path = file_path
+
+        if store_full_precision not in ("single", "double"):
+            raise ValueError("`store_full_precision` must be one of `'single'` or `'double'`")
+        self.store_full_precision = store_full_precision
 
         self._madelung = None
+        self._thc = None
+        self._sr_cache = OrderedDict()
+        self._nocc = None
+        self._nvir = None
+        self._nocc_w = None
+        self._nvir_w = None
+
+    def import_thc(self):
+        """
+        Import the tensor hypercontraction (THC) factorisation of the
+        integrals from a h5py file. The file must contain a
+        'collocation_matrix' with shape (k, AO, aux, 2) and a
+        'coulomb_matrix' with shape (q, aux, aux, 2), where the final
+        index enumerates the real and imaginary parts, along with the
+        'kpts' and 'qpts' at which they are defined. The Coulomb matrix
+        at `q` couples the pair densities at `kpts[kj] - kpts[ki]`.
+        Both are reordered to follow `self.kpts`.
+        """
+
+        if self.file_path is None:
+            raise ValueError("file path cannot be None for THC implementation")
+
+        with h5py.File(self.file_path, "r") as thc_eri:
+            coll = np.array(thc_eri["collocation_matrix"])
+            cou = np.array(thc_eri["coulomb_matrix"])
+            kpts = np.array(thc_eri["kpts"])
+            qpts = np.array(thc_eri["qpts"])
+
+        coll = coll[..., 0] + coll[..., 1] * 1.0j
+        if coll.ndim == 2:
+            coll = coll[None]
+        coll = coll.swapaxes(1, 2)
+
+        cou = cou[..., 0] + cou[..., 1] * 1.0j
+
+        # Map the k-points and q-points of the file onto the indices
+        # of `self.kpts`, which raises if one is not in the list
+        for name, pts, arr in [("k", kpts, coll), ("q", qpts, cou)]:
+            if len(pts) != len(self.kpts) or len(arr) != len(self.kpts):
+                raise ValueError(
+                    f"THC integrals are defined at {len(arr)} {name}-points, "
+                    f"but {len(self.kpts)} are required"
+                )
+            idx = [self.kpts.member(self.kpts.wrap_around(pt)) for pt in pts]
+            if len(set(idx)) != len(self.kpts):
+                raise ValueError(f"THC {name}-points do not match the k-points")
+            arr[idx] = arr.copy()
+
+        self._thc = {"coll": coll, "cou": cou}
+
+    def _sr_loop(self, ki, kj):
+        """
+        Loop over blocks of the (L|pq) integrals in the AO basis at a
+        pair of k-points. The complex blocks are cached while memory
+        remains within `with_df.max_memory`, with the least recently
+        used pairs of k-points discarded first, such that repeated
+        loops, including those in `transform`, `get_j` and `get_k`, do
+        not reload the integrals. The cache is cleared when the
+        coefficients are updated.
+        """
+
+        if (ki, kj) in self._sr_cache:
+            self._sr_cache.move_to_end((ki, kj))
+            yield from self._sr_cache[ki, kj]
+            return
+
+        def _assemble(block):
+            if block[2] == -1:
+                raise NotImplementedError("Low dimensional integrals")
+            buf = np.empty((block[0].shape[0], self.nmo, self.nmo), dtype=complex)
+            buf.real = block[0].reshape(buf.shape)
+            buf.imag = block[1].reshape(buf.shape)
+            return buf
+
+        # The disk reads are already prefetched by `sr_loop`, assemble
+        # the complex blocks in the background as well
+        blocks = []
+        sr_loop = self.with_df.sr_loop((ki, kj), compact=False)
+        for block in lib.map_with_prefetch(_assemble, sr_loop):
+            blocks.append(block)
+            yield block
+
+        # The blocks for this pair are already held in memory, so keep
+        # them if the current usage is within the budget
+        mem_avail = self.with_df.max_memory - lib.current_memory()[0]
+        mem_pair = self.naux_full * self.nmo**2 * 16 / 1e6
+        max_size = len(self._sr_cache) + 1 + int(mem_avail // mem_pair)
+        if max_size > 0:
+            self._sr_cache[ki, kj] = blocks
+            while len(self._sr_cache) > max_size:
+                self._sr_cache.popitem(last=False)
 
     def get_compression_metric(self):
         """
         Return the compression metric.
         """
 
-        # TODO MPI
-
         compression = self._parse_compression()
         if not compression:
             return None
@@ -58,46 +194,67 @@ class KIntegrals(Integrals):
 
         prod = np.zeros((len(self.kpts), self.naux_full, self.naux_full), dtype=complex)
 
+        # Get the coefficients for each kind of index
+        coeffs = {
+            "o": [c[:, o > 0] for c, o in zip(self.mo_coeff, self.mo_occ)],
+            "v": [c[:, o == 0] for c, o in zip(self.mo_coeff, self.mo_occ)],
+            "i": [c[:, o > 0] for c, o in zip(self.mo_coeff_w, self.mo_occ_w)],
+            "a": [c[:, o == 0] for c, o in zip(self.mo_coeff_w, self.mo_occ_w)],
+        }
+
         # Loop over required blocks
         for key in sorted(compression):
             logger.debug(self, f"Transforming {key} block")
-            ci, cj = [
-                {
-                    "o": [c[:, o > 0] for c, o in zip(self.mo_coeff, self.mo_occ)],
-                    "v": [c[:, o == 0] for c, o in zip(self.mo_coeff, self.mo_occ)],
-                    "i": [c[:, o > 0] for c, o in zip(self.mo_coeff_w, self.mo_occ_w)],
-                    "a": [c[:, o == 0] for c, o in zip(self.mo_coeff_w, self.mo_occ_w)],
-                }[k]
-                for k in key
-            ]
+            ci, cj = coeffs[key[0]], coeffs[key[1]]
             ni = [c.shape[-1] for c in ci]
             nj = [c.shape[-1] for c in cj]
 
-            for q, ki in self.kpts.loop(2):
-                kj = self.kpts.member(self.kpts.wrap_around(self.kpts[ki] - self.kpts[q]))
+            for idx, (q, ki) in enumerate(self.kpts.loop(2)):
+                if idx % mpi_helper.size != mpi_helper.rank:
+                    continue
+
+                kj = self.kpts.kconserv_diff[ki, q]
 
                 Lxy = np.zeros((self.naux_full, ni[ki] * nj[kj]), dtype=complex)
                 b1 = 0
-                for block in self.with_df.sr_loop((ki, kj), compact=False):
-                    if block[2] == -1:
-                        raise NotImplementedError("Low dimensional integrals")
-                    block = block[0] + block[1] * 1.0j
-                    block = block.reshape(self.naux_full, self.nmo, self.nmo)
+                for block in self._sr_loop(ki, kj):
                     b0, b1 = b1, b1 + block.shape[0]
                     logger.debug(self, f"  Block [{ki}, {kj}, {b0}:{b1}]")
 
-                    tmp = lib.einsum("Lpq,pi,qj->Lij", block, ci[ki].conj(), cj[kj])
+                    tmp = _ao2mo_L(block, ci[ki], cj[kj])
                     tmp = tmp.reshape(b1 - b0, -1)
                     Lxy[b0:b1] = tmp
 
-                prod[q] += np.dot(Lxy, Lxy.T.conj()) / len(self.kpts)
+                # Only the upper triangle is built
+                prod[q] = scipy.linalg.blas.zherk(
+                    1.0 / len(self.kpts),
+                    Lxy,
+                    beta=1.0,
+                    c=prod[q],
+                    lower=0,
+                )
+
+        prod = mpi_helper.allreduce(prod, root=0)
 
         rot = np.empty((len(self.kpts),), dtype=object)
         if mpi_helper.rank == 0:
+            # (L|ai) is compressed with the rotation at -q, so the gauge
+            # of the rotations at q and -q must be consistent: they are
+            # conjugate where the metrics are, and real where q = -q
+            q_inv = [
+                self.kpts.member(self.kpts.wrap_around(-self.kpts[q])) for q in self.kpts.loop(1)
+            ]
+            for q in self.kpts.loop(1):
+                if q_inv[q] == q and np.allclose(prod[q].imag, 0.0):
+                    prod[q] = prod[q].real
+
+            e, v = np.linalg.eigh(prod, UPLO="U")
             for q in self.kpts.loop(1):
-                e, v = np.linalg.eigh(prod[q])
-                mask = np.abs(e) > self.compression_tol
-                rot[q] = v[:, mask]
+                if q_inv[q] < q and np.allclose(np.triu(prod[q]), np.triu(prod[q_inv[q]]).conj()):
+                    rot[q] = rot[q_inv[q]].conj()
+                else:
+                    mask = np.abs(e[q]) > self.compression_tol
+                    rot[q] = v[q][:, mask]
         else:
             for q in self.kpts.loop(1):
                 rot[q] = np.zeros((0,), dtype=complex)
@@ -121,7 +278,8 @@ class KIntegrals(Integrals):
     def transform(self, do_Lpq=None, do_Lpx=True, do_Lia=True):
         """
         Initialise the integrals, building:
-            - Lpq: the full (aux, MO, MO) array if `store_full`
+            - Lpq: the full (k, k, aux, MO, MO) array, for the first
+              k-points on the current process, if `store_full`
             - Lpx: the compressed (aux, MO, MO) array
             - Lia: the compressed (aux, occ, vir) array
         """
@@ -131,11 +289,7 @@ class KIntegrals(Integrals):
             self._rot = self.get_compression_metric()
         rot = self._rot
         if rot is None:
-            eye = np.eye(self.naux_full)
-            rot = defaultdict(lambda: eye)
-        for q in self.kpts.loop(1):
-            if rot[q] is None:
-                rot[q] = np.eye(self.naux_full)
+            rot = [None] * len(self.kpts)
 
         do_Lpq = self.store_full if do_Lpq is None else do_Lpq
         if not any([do_Lpq, do_Lpx, do_Lia]):
@@ -144,59 +298,77 @@ class KIntegrals(Integrals):
         cput0 = (logger.process_clock(), logger.perf_counter())
         logger.info(self, f"Transforming {self.__class__.__name__}")
 
-        Lpq = {}
+        # The full (L|pq) array is contiguous, and only holds the first
+        # k-points on the current process
+        Lpq = None
+        if do_Lpq:
+            Lpq = np.zeros(
+                (
+                    self.kpts.loop_size(),
+                    len(self.kpts),
+                    self.naux_full,
+                    self.nmo,
+                    self.nmo,
+                ),
+                dtype=self.dtype_full,
+            )
         Lpx = {}
         Lia = {}
         Lai = {}
+        Lia_stack = {}
+        Lai_stack = {}
 
         for q in self.kpts.loop(1):
-            for ki in self.kpts.loop(1, mpi=True):
-                kj = self.kpts.member(self.kpts.wrap_around(self.kpts[q] + self.kpts[ki]))
+            # Inverse q for ki <-> kj
+            q_inv = self.kpts.member(self.kpts.wrap_around(-self.kpts[q]))
+
+            # The (L|ia) and (L|ai) blocks for the pairs of k-points on
+            # the current process are views into contiguous arrays,
+            # stacked along the ov axis
+            if do_Lia:
+                nov = [
+                    self.nocc_w[ki] * self.nvir_w[self.kpts.kconserv_sum[q, ki]]
+                    for ki in self.kpts.loop(1, mpi=True)
+                ]
+                Lia_stack[q] = np.zeros((self.naux[q], sum(nov)), dtype=complex)
+                Lai_stack[q] = np.zeros((self.naux[q_inv], sum(nov)), dtype=complex)
+                o1 = 0
+
+            for k, ki in enumerate(self.kpts.loop(1, mpi=True)):
+                kj = self.kpts.kconserv_sum[q, ki]
 
                 # Get the slices on the current process and initialise the arrays
-                Lpq_k = (
-                    np.zeros((self.naux_full, self.nmo, self.nmo), dtype=complex)
-                    if do_Lpq
-                    else None
-                )
+                Lpq_k = Lpq[k, kj] if do_Lpq else None
                 Lpx_k = (
                     np.zeros((self.naux[q], self.nmo, self.nmo_g[kj]), dtype=complex)
                     if do_Lpx
                     else None
                 )
-                Lia_k = (
-                    np.zeros((self.naux[q], self.nocc_w[ki] * self.nvir_w[kj]), dtype=complex)
-                    if do_Lia
-                    else None
-                )
-                Lai_k = (
-                    np.zeros((self.naux[q], self.nocc_w[kj] * self.nvir_w[ki]), dtype=complex)
-                    if do_Lia
-                    else None
-                )
+                Lia_k = Lai_k = None
+                if do_Lia:
+                    o0, o1 = o1, o1 + self.nocc_w[ki] * self.nvir_w[kj]
+                    Lia_k = Lia_stack[q][:, o0:o1]
+                    Lai_k = Lai_stack[q][:, o0:o1]
 
                 # Build the integrals blockwise
                 b1 = 0
-                for block in self.with_df.sr_loop((ki, kj), compact=False):  # TODO lock I/O
-                    if block[2] == -1:
-                        raise NotImplementedError("Low dimensional integrals")
-                    block = block[0] + block[1] * 1.0j
-                    block = block.reshape(self.naux_full, self.nmo, self.nmo)
+                for block in self._sr_loop(ki, kj):  # TODO lock I/O
                     b0, b1 = b1, b1 + block.shape[0]
                     logger.debug(self, f"  Block [{ki}, {kj}, {b0}:{b1}]")
 
+                    # Share the half-transformed block between (L|pq) and
+                    # (L|ia) when they use the same coefficients
+                    half = None
+                    if do_Lpq and do_Lia and self._mo_coeff_w is None:
+                        half = np.dot(block.reshape(-1, self.nmo), self.mo_coeff[kj])
+
                     # If needed, rotate the full (L|pq) array
                     if do_Lpq:
                         logger.debug(
                             self, f"(L|pq) size: ({self.naux_full}, {self.nmo}, {self.nmo})"
                         )
                         coeffs = (self.mo_coeff[ki], self.mo_coeff[kj])
-                        Lpq_k[b0:b1] = lib.einsum(
-                            "Lpq,pi,qj->Lij", block, coeffs[0].conj(), coeffs[1]
-                        )
-
-                    # Compress the block
-                    block_comp = lib.einsum("L...,LQ->Q...", block, rot[q][b0:b1].conj())
+                        Lpq_k[b0:b1] = _ao2mo_L(block, *coeffs, half=half)
 
                     # Build the compressed (L|px) array
                     if do_Lpx:
@@ -204,11 +376,16 @@ class KIntegrals(Integrals):
                             self, f"(L|px) size: ({self.naux[q]}, {self.nmo}, {self.nmo_g[ki]})"
                         )
                         coeffs = (self.mo_coeff[ki], self.mo_coeff_g[kj])
-                        Lpx_k += lib.einsum(
-                            "Lpq,pi,qj->Lij", block_comp, coeffs[0].conj(), coeffs[1]
-                        )
-
-                    # Build the compressed (L|ia) array
+                        if rot[q] is None:
+                            Lpx_k[b0:b1] += _ao2mo_L(block, *coeffs)
+                        else:
+                            block_comp = np.dot(rot[q][b0:b1].T.conj(), block.reshape(b1 - b0, -1))
+                            block_comp = block_comp.reshape(-1, self.nmo, self.nmo)
+                            Lpx_k += _ao2mo_L(block_comp, *coeffs)
+
+                    # Build the compressed (L|ia) and (L|ai) arrays. Since
+                    # (L|kj a, ki i) = (L|ki i, kj a)*, both are obtained
+                    # from the same uncompressed block.
                     if do_Lia:
                         logger.debug(
                             self,
@@ -218,49 +395,24 @@ class KIntegrals(Integrals):
                             self.mo_coeff_w[ki][:, : self.nocc_w[ki]],
                             self.mo_coeff_w[kj][:, self.nocc_w[kj] :],
                         )
-                        tmp = lib.einsum("Lpq,pi,qj->Lij", block_comp, coeffs[0].conj(), coeffs[1])
-                        tmp = tmp.reshape(self.naux[q], -1)
-                        Lia_k += tmp
+                        if half is not None:
+                            half = half[:, self.nocc_w[kj] :]
+                        tmp = _ao2mo_L(block, *coeffs, half=half)
+                        tmp = tmp.reshape(b1 - b0, -1)
+                        if rot[q] is None:
+                            Lia_k[b0:b1] += tmp
+                        else:
+                            Lia_k += np.dot(rot[q][b0:b1].T.conj(), tmp)
+                        if rot[q_inv] is None:
+                            Lai_k[b0:b1] += tmp.conj()
+                        else:
+                            Lai_k += np.dot(rot[q_inv][b0:b1].T.conj(), tmp.conj())
 
-                if do_Lpq:
-                    Lpq[ki, kj] = Lpq_k
                 if do_Lpx:
                     Lpx[ki, kj] = Lpx_k
                 if do_Lia:
                     Lia[ki, kj] = Lia_k
-                else:
-                    continue
-
-                # Inverse q for ki <-> kj
-                q = self.kpts.member(self.kpts.wrap_around(-self.kpts[q]))
-
-                # Build the integrals blockwise
-                b1 = 0
-                for block in self.with_df.sr_loop((kj, ki), compact=False):  # TODO lock I/O
-                    if block[2] == -1:
-                        raise NotImplementedError("Low dimensional integrals")
-                    block = block[0] + block[1] * 1.0j
-                    block = block.reshape(self.naux_full, self.nmo, self.nmo)
-                    b0, b1 = b1, b1 + block.shape[0]
-                    logger.debug(self, f"  Block [{ki}, {kj}, {b0}:{b1}]")
-
-                    # Compress the block
-                    block_comp = lib.einsum("L...,LQ->Q...", block, rot[q][b0:b1].conj())
-
-                    # Build the compressed (L|ai) array
-                    logger.debug(
-                        self, f"(L|ai) size: ({self.naux[q]}, {self.nvir_w[kj] * self.nocc_w[ki]})"
-                    )
-                    coeffs = (
-                        self.mo_coeff_w[kj][:, self.nocc_w[kj] :],
-                        self.mo_coeff_w[ki][:, : self.nocc_w[ki]],
-                    )
-                    tmp = lib.einsum("Lpq,pi,qj->Lij", block_comp, coeffs[0].conj(), coeffs[1])
-                    tmp = tmp.swapaxes(1, 2)
-                    tmp = tmp.reshape(self.naux[q], -1)
-                    Lai_k += tmp
-
-                Lai[ki, kj] = Lai_k
+                    Lai[ki, kj] = Lai_k
 
         if do_Lpq:
             self._blocks["Lpq"] = Lpq
@@ -269,25 +421,65 @@ class KIntegrals(Integrals):
         if do_Lia:
             self._blocks["Lia"] = Lia
             self._blocks["Lai"] = Lai
+            self._blocks["Lia_stack"] = Lia_stack
+            self._blocks["Lai_stack"] = Lai_stack
 
         logger.timer(self, "transform", *cput0)
 
+    def update_coeffs(self, mo_coeff_g=None, mo_coeff_w=None, mo_occ_w=None):
+        """
+        Update the MO coefficients for the Green's function and the
+        screened Coulomb interaction.
+        """
+
+        if mo_occ_w is not None:
+            self._nocc_w = None
+            self._nvir_w = None
+
+        self._sr_cache.clear()
+
+        Integrals.update_coeffs(
+            self,
+            mo_coeff_g=mo_coeff_g,
+            mo_coeff_w=mo_coeff_w,
+            mo_occ_w=mo_occ_w,
+        )
+
+    def _get_thc_coll(self, basis="mo"):
+        """Get the THC collocation matrices in the required basis."""
+
+        if self._thc is None:
+            self.import_thc()
+
+        coll = self._thc["coll"]
+        if basis == "mo":
+            coll = lib.einsum("kLp,kpi->kLi", coll, self.mo_coeff)
+
+        return coll
+
     def get_j(self, dm, basis="mo"):
         """Build the J matrix."""
 
         assert basis in ("ao", "mo")
 
+        if self.file_path is not None:
+            return self._get_j_thc(dm, basis=basis)
+
         vj = np.zeros_like(dm, dtype=complex)
 
         if self.store_full and basis == "mo":
-            buf = 0.0
-            for kk in self.kpts.loop(1, mpi=True):
-                buf += lib.einsum("Lpq,pq->L", self.Lpq[kk, kk], dm[kk].conj())
+            dm_full = dm.astype(self.dtype_full, copy=False)
+
+            buf = np.zeros((self.naux_full,), dtype=complex)
+            for k, kk in enumerate(self.kpts.loop(1, mpi=True)):
+                Lpq = self.Lpq[k, kk].reshape(self.naux_full, -1)
+                buf += np.dot(Lpq, dm_full[kk].conj().ravel())
 
             buf = mpi_helper.allreduce(buf)
 
-            for ki in self.kpts.loop(1, mpi=True):
-                vj[ki] += lib.einsum("Lpq,L->pq", self.Lpq[ki, ki], buf)
+            for k, ki in enumerate(self.kpts.loop(1, mpi=True)):
+                Lpq = self.Lpq[k, ki].reshape(self.naux_full, -1)
+                vj[ki] += np.dot(buf, Lpq).reshape(self.nmo, self.nmo)
 
             vj = mpi_helper.allreduce(vj)
 
@@ -299,25 +491,19 @@ class KIntegrals(Integrals):
 
             for kk in self.kpts.loop(1, mpi=True):
                 b1 = 0
-                for block in self.with_df.sr_loop((kk, kk), compact=False):  # TODO lock I/O
-                    if block[2] == -1:
-                        raise NotImplementedError("Low dimensional integrals")
-                    block = block[0] + block[1] * 1.0j
-                    block = block.reshape(self.naux_full, self.nmo, self.nmo)
+                for block in self._sr_loop(kk, kk):  # TODO lock I/O
                     b0, b1 = b1, b1 + block.shape[0]
-                    buf[b0:b1] += lib.einsum("Lpq,pq->L", block, dm[kk].conj())
+                    buf[b0:b1] += np.dot(block.reshape(b1 - b0, -1), dm[kk].conj().ravel())
 
             buf = mpi_helper.allreduce(buf)
 
             for ki in self.kpts.loop(1, mpi=True):
                 b1 = 0
-                for block in self.with_df.sr_loop((ki, ki), compact=False):
-                    if block[2] == -1:
-                        raise NotImplementedError("Low dimensional integrals")
-                    block = block[0] + block[1] * 1.0j
-                    block = block.reshape(self.naux_full, self.nmo, self.nmo)
+                for block in self._sr_loop(ki, ki):
                     b0, b1 = b1, b1 + block.shape[0]
-                    vj[ki] += lib.einsum("Lpq,L->pq", block, buf[b0:b1])
+                    vj[ki] += np.dot(buf[b0:b1], block.reshape(b1 - b0, -1)).reshape(
+                        self.nmo, self.nmo
+                    )
 
             vj = mpi_helper.allreduce(vj)
 
@@ -328,28 +514,44 @@ class KIntegrals(Integrals):
 
         return vj
 
+    def _get_j_thc(self, dm, basis="mo"):
+        """Build the J matrix using the THC integrals."""
+
+        coll = self._get_thc_coll(basis=basis)
+        cou = self._thc["cou"]
+        q = self.kpts.member(self.kpts.wrap_around(np.zeros(3)))
+
+        tmp = lib.einsum("kPp,kPq,kpq->P", coll.conj(), coll, dm.conj())
+        tmp = np.dot(cou[q], tmp)
+        vj = lib.einsum("kPp,kPq,P->kpq", coll.conj(), coll, tmp)
+
+        vj /= len(self.kpts)
+
+        return vj
+
     def get_k(self, dm, basis="mo", ewald=False):
         """Build the K matrix."""
 
         assert basis in ("ao", "mo")
 
+        if self.file_path is not None:
+            vk = self._get_k_thc(dm, basis=basis)
+            if ewald:
+                vk += self.get_ewald(dm, basis=basis)
+            return vk
+
         vk = np.zeros_like(dm, dtype=complex)
 
         if self.store_full and basis == "mo":
-            # TODO is there a better way to distribute this?
-            for p0, p1 in lib.prange(0, self.naux_full, 240):
-                buf = np.zeros(
-                    (len(self.kpts), len(self.kpts), p1 - p0, self.nmo, self.nmo), dtype=complex
-                )
-                for ki in self.kpts.loop(1, mpi=True):
-                    for kk in self.kpts.loop(1):
-                        buf[kk, ki] = lib.einsum("Lpq,qr->Lrp", self.Lpq[ki, kk][p0:p1], dm[kk])
-
-                buf = mpi_helper.allreduce(buf)
+            dm_full = dm.astype(self.dtype_full, copy=False)
 
-                for ki in self.kpts.loop(1):
-                    for kk in self.kpts.loop(1, mpi=True):
-                        vk[ki] += lib.einsum("Lrp,Lrs->ps", buf[kk, ki], self.Lpq[kk, ki][p0:p1])
+            # Each process holds (L|pq) for its own ki, and uses the
+            # symmetry (L|kk r, ki s) = (L|ki s, kk r)* to avoid
+            # communicating the intermediates
+            for k, ki in enumerate(self.kpts.loop(1, mpi=True)):
+                for kk in self.kpts.loop(1):
+                    tmp = lib.einsum("Lpq,qr->Lpr", self.Lpq[k, kk], dm_full[kk])
+                    vk[ki] += lib.einsum("Lpr,Lsr->ps", tmp, self.Lpq[k, kk].conj())
 
             vk = mpi_helper.allreduce(vk)
 
@@ -361,25 +563,21 @@ class KIntegrals(Integrals):
                 buf = np.zeros((len(self.kpts), self.naux_full, self.nmo, self.nmo), dtype=complex)
                 for ki in self.kpts.loop(1, mpi=True):
                     b1 = 0
-                    for block in self.with_df.sr_loop((ki, kk), compact=False):
-                        if block[2] == -1:
-                            raise NotImplementedError("Low dimensional integrals")
-                        block = block[0] + block[1] * 1.0j
-                        block = block.reshape(self.naux_full, self.nmo, self.nmo)
+                    for block in self._sr_loop(ki, kk):
                         b0, b1 = b1, b1 + block.shape[0]
-                        buf[ki, b0:b1] = lib.einsum("Lpq,qr->Lrp", block, dm[kk])
+                        tmp = np.dot(block.reshape(-1, self.nmo), dm[kk])
+                        buf[ki, b0:b1] = tmp.reshape(-1, self.nmo, self.nmo).swapaxes(1, 2)
 
                 buf = mpi_helper.allreduce(buf)
 
                 for ki in self.kpts.loop(1, mpi=True):
                     b1 = 0
-                    for block in self.with_df.sr_loop((kk, ki), compact=False):
-                        if block[2] == -1:
-                            raise NotImplementedError("Low dimensional integrals")
-                        block = block[0] + block[1] * 1.0j
-                        block = block.reshape(self.naux_full, self.nmo, self.nmo)
+                    for block in self._sr_loop(kk, ki):
                         b0, b1 = b1, b1 + block.shape[0]
-                        vk[ki] += lib.einsum("Lrp,Lrs->ps", buf[ki, b0:b1], block)
+                        vk[ki] += np.dot(
+                            buf[ki, b0:b1].reshape(-1, self.nmo).T,
+                            block.reshape(-1, self.nmo),
+                        )
 
             vk = mpi_helper.allreduce(vk)
 
@@ -393,6 +591,28 @@ class KIntegrals(Integrals):
 
         return vk
 
+    def _get_k_thc(self, dm, basis="mo"):
+        """Build the K matrix using the THC integrals."""
+
+        coll = self._get_thc_coll(basis=basis)
+        cou = self._thc["cou"]
+
+        vk = np.zeros_like(dm, dtype=complex)
+
+        # Contract the density matrix into the auxiliary space at each k-point
+        tmp = lib.einsum("kPq,kqr,kQr->kPQ", coll, dm, coll.conj())
+
+        for ki in self.kpts.loop(1):
+            buf = 0.0
+            for kk in self.kpts.loop(1):
+                q = self.kpts.kconserv_diff[kk, ki]
+                buf += cou[q] * tmp[kk]
+            vk[ki] = np.linalg.multi_dot((coll[ki].T.conj(), buf, coll[ki]))
+
+        vk /= len(self.kpts)
+
+        return vk
+
     def get_ewald(self, dm, basis="mo"):
         """Build the Ewald exchange divergence matrix."""
 
@@ -413,9 +633,24 @@ class KIntegrals(Integrals):
         Return the Madelung constant for the lattice.
         """
         if self._madelung is None:
-            self._madeling = tools.pbc.madelung(self.with_df.cell, self.kpts._kpts)
+            self._madelung = tools.pbc.madelung(self.with_df.cell, self.kpts._kpts)
         return self._madelung
 
+    @property
+    def dtype_full(self):
+        """
+        Return the dtype of the full uncompressed (aux, MO, MO) array.
+        """
+        return np.complex64 if self.store_full_precision == "single" else np.complex128
+
+    @property
+    def Lpq(self):
+        """
+        Return the full uncompressed (k, k, aux, MO, MO) array, where
+        the first index enumerates the k-points on the current process.
+        """
+        return self._blocks["Lpq"]
+
     @property
     def Lai(self):
         """
@@ -423,6 +658,24 @@ class KIntegrals(Integrals):
         """
         return self._blocks["Lai"]
 
+    @property
+    def Lia_stack(self):
+        """
+        Return the compressed (aux, W occ * W vir) arrays at each
+        q-point, with the blocks of `Lia` for the k-points on the
+        current process stacked along the last axis.
+        """
+        return self._blocks["Lia_stack"]
+
+    @property
+    def Lai_stack(self):
+        """
+        Return the compressed (aux, W vir * W occ) arrays at each
+        q-point, with the blocks of `Lai` for the k-points on the
+        current process stacked along the last axis.
+        """
+        return self._blocks["Lai_stack"]
+
     @property
     def nmo(self):
         """
@@ -436,14 +689,18 @@ class KIntegrals(Integrals):
         """
         Return the number of occupied MOs.
         """
-        return [np.sum(o > 0) for o in self.mo_occ]
+        if self._nocc is None:
+            self._nocc = np.array([np.sum(o > 0) for o in self.mo_occ])
+        return self._nocc
 
     @property
     def nvir(self):
         """
         Return the number of virtual MOs.
         """
-        return [np.sum(o == 0) for o in self.mo_occ]
+        if self._nvir is None:
+            self._nvir = np.array([np.sum(o == 0) for o in self.mo_occ])
+        return self._nvir
 
     @property
     def nmo_g(self):
@@ -465,7 +722,9 @@ class KIntegrals(Integrals):
         Return the number of occupied MOs for the screened Coulomb
         interaction.
         """
-        return [np.sum(o > 0) for o in self.mo_occ_w]
+        if self._nocc_w is None:
+            self._nocc_w = np.array([np.sum(o > 0) for o in self.mo_occ_w])
+        return self._nocc_w
 
     @property
     def nvir_w(self):
@@ -473,7 +732,9 @@ class KIntegrals(Integrals):
         Return the number of virtual MOs for the screened Coulomb
         interaction.
         """
-        return [np.sum(o == 0) for o in self.mo_occ_w]
+        if self._nvir_w is None:
+            self._nvir_w = np.array([np.sum(o == 0) for o in self.mo_occ_w])
+        return self._nvir_w
 
     @property
     def naux(self):
@@ -46,6 +46,9 @@ class KPoints:
 
         self._kconserv = kpts_helper.get_kconserv(cell, kpts)
         self._kpts_hash = {self.hash_kpts(kpt): k for k, kpt in enumerate(self._kpts)}
+        self._kconserv_sum = None
+        self._kconserv_diff = None
+        self._loops = {}
 
     @allow_single_kpt(output_is_kpts=True)
     def get_scaled_kpts(self, kpts):
@@ -98,11 +101,49 @@ class KPoints:
         """
         return self._kconserv[ki, kj, kk]
 
+    def _build_kconserv_table(self, sign):
+        """
+        Build a table of the indices of the k-points resulting from the
+        sum or difference of each pair of k-points.
+        """
+
+        kpts = self._kpts[:, None] + sign * self._kpts[None, :]
+        kpts = self.wrap_around(kpts.reshape(-1, 3))
+        table = np.array([self.member(kpt) for kpt in kpts], dtype=np.int64)
+
+        return table.reshape(len(self), len(self))
+
+    @property
+    def kconserv_sum(self):
+        """
+        Return the table of k-point indices such that
+        `kconserv_sum[ki, kj]` is the index of `kpts[ki] + kpts[kj]`.
+        """
+        if self._kconserv_sum is None:
+            self._kconserv_sum = self._build_kconserv_table(1)
+        return self._kconserv_sum
+
+    @property
+    def kconserv_diff(self):
+        """
+        Return the table of k-point indices such that
+        `kconserv_diff[ki, kj]` is the index of `kpts[ki] - kpts[kj]`.
+        """
+        if self._kconserv_diff is None:
+            self._kconserv_diff = self._build_kconserv_table(-1)
+        return self._kconserv_diff
+
     def loop(self, depth, mpi=False):
         """
         Iterate over all combinations of k-points up to a given depth.
+        The combinations are cached, such that nested loops do not
+        regenerate them.
         """
 
+        if (depth, mpi) in self._loops:
+            yield from self._loops[depth, mpi]
+            return
+
         if depth == 1:
             seq = range(len(self))
         else:
@@ -117,7 +158,9 @@ class KPoints:
 
             seq = itertools.islice(seq, p0, p1)
 
-        yield from seq
+        self._loops[depth, mpi] = tuple(seq)
+
+        yield from self._loops[depth, mpi]
 
     def loop_size(self, depth=1):
         """
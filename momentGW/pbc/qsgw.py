@@ -4,7 +4,6 @@ constraints for periodic systems.
 """
 
 import numpy as np
-from pyscf import lib
 from pyscf.agf2 import GreensFunction, mpi_helper
 from pyscf.agf2.dfragf2 import get_jk
 from pyscf.ao2mo import _ao2mo
@@ -55,16 +54,17 @@ class qsKGW(KGW, qsGW):
             Matrix projected into the desired basis at each k-point.
         """
 
-        proj = lib.einsum("k...pq,k...pi,k...qj->k...ij", ovlp, np.conj(mo1), mo2)
+        proj = np.matmul(np.conj(mo1).swapaxes(-1, -2), np.matmul(ovlp, mo2))
 
         if isinstance(matrix, np.ndarray):
-            projected_matrix = lib.einsum(
-                "k...pq,k...pi,k...qj->k...ij", matrix, np.conj(proj), proj
-            )
+            # Insert axes after the k-point axis to broadcast over any
+            # further leading axes of the matrix
+            proj = proj.reshape(proj.shape[:1] + (1,) * (matrix.ndim - 3) + proj.shape[1:])
+            projected_matrix = np.matmul(proj.conj().swapaxes(-1, -2), np.matmul(matrix, proj))
         else:
             projected_matrix = []
             for k, m in enumerate(matrix):
-                coupling = lib.einsum("pk,pi->ik", m.coupling, np.conj(proj[k]))
+                coupling = np.dot(proj[k].conj().T, m.coupling)
                 projected_m = m.copy()
                 projected_m.coupling = coupling
                 projected_matrix.append(projected_m)
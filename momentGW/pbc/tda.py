@@ -3,7 +3,7 @@ Construct TDA moments with periodic boundary conditions.
 """
 
 import numpy as np
-import scipy.special
+import scipy.linalg
 from pyscf import lib
 from pyscf.agf2 import mpi_helper
 from pyscf.pbc.gw.krgw_ac import get_qij
@@ -75,6 +75,7 @@ class TDA(MolTDA):
             self.compression_tol = gw.compression_tol
         else:
             self.compression_tol = None
+        self.moment_dtype = np.dtype(gw.moment_dtype)
 
     def build_dd_moments(self):
         """Build the moments of the density-density response."""
@@ -84,84 +85,123 @@ class TDA(MolTDA):
         lib.logger.debug(self.gw, "Memory usage: %.2f GB", self._memory_usage())
 
         kpts = self.kpts
-        moments = np.zeros((self.nkpts, self.nkpts, self.nmom_max + 1), dtype=object)
-
-        # Get the zeroth order moment
+        naux = self.naux
+        dtype = self.moment_dtype
+        moments = {}
+        d = {}
+
+        # Get the energy differences
+        d_k = {}
+        for kj, kb in kpts.loop(2):
+            d_k[kj, kb] = (
+                self.mo_energy_w[kb][self.mo_occ_w[kb] == 0][None]
+                - self.mo_energy_w[kj][self.mo_occ_w[kj] > 0][:, None]
+            ).ravel()
+
+        # Get the zeroth order moment. For each q-point, the integrals
+        # and energy differences at the local k-points are stacked along
+        # the ov axis, such that sums over k-points are single GEMMs.
+        # The recursion is performed for the complex conjugate of the
+        # moments, which avoids conjugating the integrals.
         for q in kpts.loop(1):
-            for kj in kpts.loop(1, mpi=True):
-                kb = kpts.member(kpts.wrap_around(kpts[q] + kpts[kj]))
-                moments[q, kb, 0] += self.integrals.Lia[kj, kb] / self.nkpts
+            Lia = self.integrals.Lia_stack[q]
+            d[q] = self._stack_ov(q, d_k).astype(dtype.char.lower())
+            moments[q] = np.zeros((self.nmom_max + 1,) + Lia.shape, dtype=dtype)
+            np.conj(Lia, out=moments[q][0])
+            moments[q][0] /= self.nkpts
         cput1 = lib.logger.timer(self.gw, "zeroth moment", *cput0)
 
-        # Get the higher order moments
+        # Get the higher order moments. The (aux|aux) intermediates for
+        # all q-points are reduced over processes together, padded to
+        # the largest auxiliary space.
         for i in range(1, self.nmom_max + 1):
-            for q in kpts.loop(1):
-                for kj in kpts.loop(1, mpi=True):
-                    kb = kpts.member(kpts.wrap_around(kpts[q] + kpts[kj]))
-
-                    d = lib.direct_sum(
-                        "a-i->ia",
-                        self.mo_energy_w[kb][self.mo_occ_w[kb] == 0],
-                        self.mo_energy_w[kj][self.mo_occ_w[kj] > 0],
-                    )
-                    moments[q, kb, i] += moments[q, kb, i - 1] * d.ravel()[None]
+            tmp = np.zeros((self.nkpts, max(naux), max(naux)), dtype=dtype)
 
-                tmp = np.zeros((self.naux[q], self.naux[q]), dtype=complex)
-                for ki in kpts.loop(1, mpi=True):
-                    ka = kpts.member(kpts.wrap_around(kpts[q] + kpts[ki]))
-
-                    tmp += np.dot(moments[q, ka, i - 1], self.integrals.Lia[ki, ka].T.conj())
-
-                tmp = mpi_helper.allreduce(tmp)
-                tmp *= 2.0
-                tmp /= self.nkpts
+            for q in kpts.loop(1):
+                Lia = self.integrals.Lia_stack[q].astype(dtype, copy=False)
+                np.multiply(moments[q][i - 1], d[q], out=moments[q][i])
+                tmp[q, : naux[q], : naux[q]] = np.dot(moments[q][i - 1], Lia.T)
 
-                for kj in kpts.loop(1, mpi=True):
-                    kb = kpts.member(kpts.wrap_around(kpts[q] + kpts[kj]))
+            tmp = mpi_helper.allreduce(tmp)
+            tmp *= 2.0
+            tmp /= self.nkpts
 
-                    moments[q, kb, i] += np.dot(tmp, self.integrals.Lai[kj, kb].conj())
+            for q in kpts.loop(1):
+                Lai = self.integrals.Lai_stack[q].astype(dtype, copy=False)
+                moments[q][i] += np.dot(tmp[q, : naux[q], : naux[q]], Lai)
 
             cput1 = lib.logger.timer(self.gw, "moment %d" % i, *cput1)
 
+        for q in kpts.loop(1):
+            np.conj(moments[q], out=moments[q])
+
         return moments
 
     def convolve(self, eta):
         """Handle the convolution of the moments of G and W."""
 
         kpts = self.kpts
+        dtype = self.moment_dtype
 
-        # Setup dependent on diagonal SE
-        if self.gw.diagonal_se:
-            pqchar = pchar = qchar = "p"
-            fproc = lambda x: np.diag(x)
-        else:
-            pqchar, pchar, qchar = "pq", "p", "q"
-            fproc = lambda x: x
-
-        moments_occ = np.zeros((self.nkpts, self.nmom_max + 1, self.nmo, self.nmo), dtype=complex)
-        moments_vir = np.zeros((self.nkpts, self.nmom_max + 1, self.nmo, self.nmo), dtype=complex)
+        moments_occ = np.zeros((self.nkpts, self.nmom_max + 1, self.nmo, self.nmo), dtype=dtype)
+        moments_vir = np.zeros((self.nkpts, self.nmom_max + 1, self.nmo, self.nmo), dtype=dtype)
         moms = np.arange(self.nmom_max + 1)
-        for n in moms:
-            fp = scipy.special.binom(n, moms)
-            fh = fp * (-1) ** moms
-            for q in kpts.loop(1):
-                for kp in kpts.loop(1, mpi=True):
-                    kx = kpts.member(kpts.wrap_around(kpts[kp] - kpts[q]))
-                    subscript = f"t,kt,kt{pqchar}->{pqchar}"
 
-                    eo = np.power.outer(self.mo_energy_g[kx][self.mo_occ_g[kx] > 0], n - moms)
-                    to = lib.einsum(subscript, fh, eo, eta[kp, q][self.mo_occ_g[kx] > 0])
-                    moments_occ[kp, n] += fproc(to)
+        # Build Pascal's triangle for the binomial coefficients
+        binom = np.zeros((self.nmom_max + 1, self.nmom_max + 1))
+        binom[:, 0] = 1.0
+        for n in moms[1:]:
+            binom[n, 1 : n + 1] = binom[n - 1, :n] + binom[n - 1, 1 : n + 1]
+        fp = binom
+        fh = binom * (-1) ** moms[None]
+
+        # Get the weights of each term t in each moment n, with shape
+        # (n, k, t). Terms with t > n have vanishing coefficients.
+        expo = np.maximum(moms[:, None] - moms[None, :], 0)
+        occ = [o > 0 for o in self.mo_occ_g]
+        vir = [o == 0 for o in self.mo_occ_g]
+        wo = []
+        wv = []
+        for k, e in enumerate(self.mo_energy_g):
+            eo = np.power.outer(e[occ[k]], moms)
+            ev = np.power.outer(e[vir[k]], moms)
+            wo.append((fh[:, None] * eo[:, expo].swapaxes(0, 1)).astype(dtype.char.lower()))
+            wv.append((fp[:, None] * ev[:, expo].swapaxes(0, 1)).astype(dtype.char.lower()))
 
-                    ev = np.power.outer(self.mo_energy_g[kx][self.mo_occ_g[kx] == 0], n - moms)
-                    tv = lib.einsum(subscript, fp, ev, eta[kp, q][self.mo_occ_g[kx] == 0])
-                    moments_vir[kp, n] += fproc(tv)
+        if self.gw.diagonal_se:
+            idx = np.diag_indices(self.nmo)
+            fpack = lambda x: x
+        else:
+            # The moments are Hermitian, so only the upper triangle is
+            # contracted
+            idx = np.triu_indices(self.nmo)
+            fpack = lambda x: x[..., idx[0], idx[1]]
 
-        # Numerical integration can lead to small non-hermiticity
-        for n in range(self.nmom_max + 1):
-            for k in kpts.loop(1, mpi=True):
-                moments_occ[k, n] = 0.5 * (moments_occ[k, n] + moments_occ[k, n].T.conj())
-                moments_vir[k, n] = 0.5 * (moments_vir[k, n] + moments_vir[k, n].T.conj())
+        for q in kpts.loop(1):
+            for kp in kpts.loop(1, mpi=True):
+                kx = kpts.kconserv_diff[kp, q]
+                eta_kq = fpack(eta[kp, q])
+
+                # Contract all moment orders in a single GEMM
+                eta_occ = eta_kq[occ[kx]]
+                to = np.dot(
+                    wo[kx].reshape(self.nmom_max + 1, -1), eta_occ.reshape(wo[kx][0].size, -1)
+                )
+                eta_vir = eta_kq[vir[kx]]
+                tv = np.dot(
+                    wv[kx].reshape(self.nmom_max + 1, -1), eta_vir.reshape(wv[kx][0].size, -1)
+                )
+
+                moments_occ[kp][:, idx[0], idx[1]] += to
+                moments_vir[kp][:, idx[0], idx[1]] += tv
+
+        # Mirror the upper triangle, which also removes any small
+        # non-hermiticity from numerical integration
+        diag = np.diag_indices(self.nmo)
+        moments_occ = moments_occ + moments_occ.swapaxes(-1, -2).conj()
+        moments_occ[..., diag[0], diag[1]] *= 0.5
+        moments_vir = moments_vir + moments_vir.swapaxes(-1, -2).conj()
+        moments_vir[..., diag[0], diag[1]] *= 0.5
 
         moments_occ = mpi_helper.allreduce(moments_occ)
         moments_vir = mpi_helper.allreduce(moments_vir)
@@ -176,38 +216,55 @@ class TDA(MolTDA):
         lib.logger.debug(self.gw, "Memory usage: %.2f GB", self._memory_usage())
 
         kpts = self.kpts
+        dtype = self.moment_dtype
 
         # Setup dependent on diagonal SE
         if self.gw.diagonal_se:
-            pqchar = pchar = qchar = "p"
             eta_shape = lambda k: (self.mo_energy_g[k].size, self.nmom_max + 1, self.nmo)
         else:
-            pqchar, pchar, qchar = "pq", "p", "q"
             eta_shape = lambda k: (self.mo_energy_g[k].size, self.nmom_max + 1, self.nmo, self.nmo)
         eta = np.zeros((self.nkpts, self.nkpts), dtype=object)
+        for q in kpts.loop(1):
+            for kp in kpts.loop(1, mpi=True):
+                eta[kp, q] = np.zeros(eta_shape(kpts.kconserv_diff[kp, q]), dtype=dtype)
+
+        # Get the moments in (aux|aux) and rotate to (mo|mo). The
+        # (aux|aux) moments for all q-points are reduced over processes
+        # together, padded to the largest auxiliary space. The conjugate
+        # transpose of the integrals is applied within the GEMM, which
+        # acts on the transposed (Fortran-ordered) views.
+        naux = self.naux
+        gemm = scipy.linalg.blas.get_blas_funcs("gemm", dtype=dtype)
 
-        # Get the moments in (aux|aux) and rotate to (mo|mo)
         for n in range(self.nmom_max + 1):
+            eta_aux = np.zeros((self.nkpts, max(naux), max(naux)), dtype=dtype)
             for q in kpts.loop(1):
-                eta_aux = 0
-                for kj in kpts.loop(1, mpi=True):
-                    kb = kpts.member(kpts.wrap_around(kpts[q] + kpts[kj]))
-                    eta_aux += np.dot(moments_dd[q, kb, n], self.integrals.Lia[kj, kb].T.conj())
+                Lia = self.integrals.Lia_stack[q].astype(dtype, copy=False)
+                tmp = gemm(1.0, Lia.T, moments_dd[q][n].T, trans_a=2)
+                eta_aux[q, : naux[q], : naux[q]] = tmp.T
 
-                eta_aux = mpi_helper.allreduce(eta_aux)
-                eta_aux *= 2.0
-                eta_aux /= self.nkpts
+            eta_aux = mpi_helper.allreduce(eta_aux)
+            eta_aux *= 2.0
+            eta_aux /= self.nkpts
 
+            for q in kpts.loop(1):
                 for kp in kpts.loop(1, mpi=True):
-                    kx = kpts.member(kpts.wrap_around(kpts[kp] - kpts[q]))
+                    kx = kpts.kconserv_diff[kp, q]
 
-                    if not isinstance(eta[kp, q], np.ndarray):
-                        eta[kp, q] = np.zeros(eta_shape(kx), dtype=eta_aux.dtype)
-
-                    for x in range(self.mo_energy_g[kx].size):
-                        Lp = self.integrals.Lpx[kp, kx][:, :, x]
-                        subscript = f"P{pchar},Q{qchar},PQ->{pqchar}"
-                        eta[kp, q][x, n] += lib.einsum(subscript, Lp, Lp.conj(), eta_aux)
+                    # Rotate for all Green's function orbitals x at once
+                    Lpx = self.integrals.Lpx[kp, kx].astype(dtype, copy=False)
+                    tmp = np.dot(
+                        eta_aux[q, : naux[q], : naux[q]],
+                        Lpx.reshape(Lpx.shape[0], -1).conj(),
+                    )
+                    tmp = tmp.reshape(Lpx.shape)
+                    if self.gw.diagonal_se:
+                        eta[kp, q][:, n] += np.einsum("Ppx,Ppx->xp", Lpx, tmp)
+                    else:
+                        eta[kp, q][:, n] += np.matmul(
+                            Lpx.transpose(2, 1, 0),
+                            tmp.transpose(2, 0, 1),
+                        )
 
         cput1 = lib.logger.timer(self.gw, "rotating DD moments", *cput0)
 
@@ -215,11 +272,25 @@ class TDA(MolTDA):
         moments_occ, moments_vir = self.convolve(eta)
         cput1 = lib.logger.timer(self.gw, "constructing SE moments", *cput1)
 
+        # Return the moments in double precision
+        moments_occ = moments_occ.astype(complex, copy=False)
+        moments_vir = moments_vir.astype(complex, copy=False)
+
         return moments_occ, moments_vir
 
     def build_dd_moments_exact(self):
         raise NotImplementedError
 
+    def _stack_ov(self, q, blocks):
+        """
+        Stack the blocks at each pair of k-points `(kj, kb)` that
+        conserves momentum with `q`, for the k-points `kj` on the
+        current process, along their final (ov) axis.
+        """
+        kpts = self.kpts
+        arrays = [blocks[kj, kpts.kconserv_sum[q, kj]] for kj in kpts.loop(1, mpi=True)]
+        return np.concatenate([np.zeros((0,))] + arrays, axis=-1)
+
     @property
     def naux(self):
         """Number of auxiliaries."""
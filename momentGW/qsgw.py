@@ -99,6 +99,10 @@ def kernel(
     # Get the moments
     th, tp = gw.self_energy_to_moments(se, nmom_max)
 
+    # Rotation of the orbitals from the reference basis, unchanged if
+    # the QP loop does not run
+    u = np.eye(mo_coeff.shape[-1])
+
     conv = False
     for cycle in range(1, gw.max_cycle + 1):
         logger.info(gw, "%s iteration %d", gw.name, cycle)
@@ -120,11 +124,14 @@ def kernel(
             fock = integrals.get_fock(dm, h1e)
             fock_eff = fock + se_qp
             fock_eff = diis_qp.update(fock_eff)
-            fock_eff = mpi_helper.bcast(fock_eff, root=0)
 
-            mo_energy, u = np.linalg.eigh(fock_eff)
+            if mpi_helper.rank == 0:
+                mo_energy, u = np.linalg.eigh(fock_eff)
+            else:
+                mo_energy = np.zeros((0,))
+                u = np.zeros((0,))
+            mo_energy = mpi_helper.bcast(mo_energy, root=0)
             u = mpi_helper.bcast(u, root=0)
-            mo_coeff = lib.einsum("...pq,...qi->...pi", mo_coeff_ref, u)
 
             dm_prev = dm
             dm = gw._scf.make_rdm1(u, gw.mo_occ)
@@ -138,6 +145,9 @@ def kernel(
         else:
             logger.info(gw, "QP loop failed to converge.")
 
+        # Rotate the orbitals from the final QP iteration
+        mo_coeff = lib.einsum("...pq,...qi->...pi", mo_coeff_ref, u)
+
         # Update the self-energy
         subgw.mo_energy = mo_energy
         subgw.mo_coeff = mo_coeff
@@ -271,12 +281,12 @@ class qsGW(GW):
             Matrix projected into the desired basis.
         """
 
-        proj = lib.einsum("...pq,...pi,...qj->...ij", ovlp, mo1, mo2)
+        proj = np.matmul(mo1.swapaxes(-1, -2), np.matmul(ovlp, mo2))
 
         if isinstance(matrix, np.ndarray):
-            projected_matrix = lib.einsum("...pq,...pi,...qj->...ij", matrix, proj, proj)
+            projected_matrix = np.matmul(proj.swapaxes(-1, -2), np.matmul(matrix, proj))
         else:
-            coupling = lib.einsum("...pk,...pi->...ik", matrix.coupling, proj)
+            coupling = np.matmul(proj.swapaxes(-1, -2), matrix.coupling)
             projected_matrix = matrix.copy()
             projected_matrix.coupling = coupling
 
@@ -323,15 +333,15 @@ class qsGW(GW):
         if self.srg == 0.0:
             eta = np.sign(se.energy) * self.eta * 1.0j
             denom = lib.direct_sum("p-q-q->pq", mo_energy, se.energy, eta)
-            se_i = lib.einsum("pk,qk,pk->pq", se.coupling, np.conj(se.coupling), 1 / denom)
-            se_j = lib.einsum("pk,qk,qk->pq", se.coupling, np.conj(se.coupling), 1 / denom)
+            se_i = np.dot(se.coupling / denom, np.conj(se.coupling).T)
+            se_j = np.dot(se.coupling, (np.conj(se.coupling) / denom).T)
         else:
             denom = lib.direct_sum("p-q->pq", mo_energy, se.energy)
             d2p = lib.direct_sum("pk,qk->pqk", denom**2, denom**2)
             reg = 1 - np.exp(-d2p * self.srg)
             reg *= lib.direct_sum("pk,qk->pqk", denom, denom)
             reg /= d2p
-            se_i = lib.einsum("pk,qk,pqk->pq", se.coupling, np.conj(se.coupling), reg)
+            se_i = lib.einsum("pqk,pk,qk->pq", reg, se.coupling, np.conj(se.coupling))
             se_j = se_i.T.conj()
 
         se_ij = 0.5 * (se_i + se_j)
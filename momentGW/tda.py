@@ -131,36 +131,51 @@ class TDA:
         # Setup dependent on diagonal SE
         q0, q1 = self.mpi_slice(self.mo_energy_g.size)
         if self.gw.diagonal_se:
-            pq = p = q = "p"
-            fproc = lambda x: np.diag(x)
+            idx = np.diag_indices(self.nmo)
+            fpack = lambda x: x
         else:
-            pq, p, q = "pq", "p", "q"
-            fproc = lambda x: x
+            # The moments are symmetric, so only the upper triangle is
+            # contracted
+            idx = np.triu_indices(self.nmo)
+            fpack = lambda x: x[..., idx[0], idx[1]]
 
         moments_occ = np.zeros((self.nmom_max + 1, self.nmo, self.nmo))
         moments_vir = np.zeros((self.nmom_max + 1, self.nmo, self.nmo))
         moms = np.arange(self.nmom_max + 1)
 
+        # Split the energies and moments into occupied and virtual
+        # sectors once, rather than for every moment order
+        occ = self.mo_occ_g[q0:q1] > 0
+        vir = self.mo_occ_g[q0:q1] == 0
+        eps_occ = self.mo_energy_g[q0:q1][occ]
+        eps_vir = self.mo_energy_g[q0:q1][vir]
+        eta_occ = fpack(eta[occ])
+        eta_vir = fpack(eta[vir])
+
         for n in moms:
             fp = scipy.special.binom(n, moms)
             fh = fp * (-1) ** moms
 
-            if np.any(self.mo_occ_g[q0:q1] > 0):
-                eo = np.power.outer(self.mo_energy_g[q0:q1][self.mo_occ_g[q0:q1] > 0], n - moms)
-                to = lib.einsum(f"t,kt,kt{pq}->{pq}", fh, eo, eta[self.mo_occ_g[q0:q1] > 0])
-                moments_occ[n] += fproc(to)
+            if eps_occ.size:
+                eo = np.power.outer(eps_occ, n - moms)
+                to = lib.einsum("t,kt,ktp->p", fh, eo, eta_occ)
+                moments_occ[n][idx] += to
 
-            if np.any(self.mo_occ_g[q0:q1] == 0):
-                ev = np.power.outer(self.mo_energy_g[q0:q1][self.mo_occ_g[q0:q1] == 0], n - moms)
-                tv = lib.einsum(f"t,ct,ct{pq}->{pq}", fp, ev, eta[self.mo_occ_g[q0:q1] == 0])
-                moments_vir[n] += fproc(tv)
+            if eps_vir.size:
+                ev = np.power.outer(eps_vir, n - moms)
+                tv = lib.einsum("t,ct,ctp->p", fp, ev, eta_vir)
+                moments_vir[n][idx] += tv
 
         moments_occ = mpi_helper.allreduce(moments_occ)
         moments_vir = mpi_helper.allreduce(moments_vir)
 
-        # Numerical integration can lead to small non-hermiticity
-        moments_occ = 0.5 * (moments_occ + moments_occ.swapaxes(1, 2))
-        moments_vir = 0.5 * (moments_vir + moments_vir.swapaxes(1, 2))
+        # Mirror the upper triangle, which also removes any small
+        # non-hermiticity from numerical integration
+        diag = np.diag_indices(self.nmo)
+        moments_occ = moments_occ + moments_occ.swapaxes(1, 2)
+        moments_occ[:, diag[0], diag[1]] *= 0.5
+        moments_vir = moments_vir + moments_vir.swapaxes(1, 2)
+        moments_vir[:, diag[0], diag[1]] *= 0.5
 
         return moments_occ, moments_vir
 
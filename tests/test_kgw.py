@@ -3,12 +3,13 @@ Tests for `pbc/gw.py`
 """
 
 import unittest
+from unittest import mock
 
 import numpy as np
 import pytest
 from pyscf.pbc import gto, dft, scf
 from pyscf.pbc.tools import k2gamma
-from pyscf.agf2 import mpi_helper
+from pyscf.agf2 import GreensFunction, mpi_helper
 
 from momentGW import GW
 from momentGW import KGW
@@ -130,6 +131,156 @@ class Test_KGW(unittest.TestCase):
 
         self._test_vs_supercell(gw, kgw, full=False, tol=1e-5)
 
+    def test_compression_gauge(self):
+        # (L|ai) is compressed with the rotation at -q, so the moments
+        # depend on the rotations at q and -q being conjugate
+        kgw = KGW(self.mf, polarizability="dtda", compression="ia")
+        integrals = kgw.ao2mo(transform=False)
+        rot = integrals.get_compression_metric()
+
+        kpts = integrals.kpts
+        for q in kpts.loop(1):
+            q_inv = kpts.member(kpts.wrap_around(-kpts[q]))
+            np.testing.assert_allclose(rot[q], rot[q_inv].conj(), atol=1e-12)
+
+
+class Test_KGW_2D(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cell = gto.Cell()
+        cell.atom = "He 0 0 0; He 1 1 1"
+        cell.basis = "6-31g"
+        cell.a = np.eye(3) * 3
+        cell.max_memory = 1e10
+        cell.verbose = 0
+        cell.build()
+
+        kmesh = [2, 2, 1]
+        kpts = cell.make_kpts(kmesh)
+
+        mf = dft.KRKS(cell, kpts, xc="hf")
+        mf = mf.density_fit(auxbasis="weigend")
+        mf.with_df._prefer_ccdf = True
+        mf.with_df.force_dm_kbuild = True
+        mf.exxdiv = None
+        mf.conv_tol = 1e-10
+        mf.kernel()
+
+        for k in range(len(kpts)):
+            mf.mo_coeff[k] = mpi_helper.bcast_dict(mf.mo_coeff[k], root=0)
+            mf.mo_energy[k] = mpi_helper.bcast_dict(mf.mo_energy[k], root=0)
+
+        cls.cell, cls.kpts, cls.mf = cell, kpts, mf
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.cell, cls.kpts, cls.mf
+
+    def _get_moments(self, nmom_max, **kwargs):
+        kgw = KGW(self.mf, polarizability="dtda", **kwargs)
+        integrals = kgw.ao2mo()
+        return kgw.build_se_moments(nmom_max, integrals)
+
+    def test_jk(self):
+        kgw = KGW(self.mf)
+        integrals = kgw.ao2mo()
+        dm = np.array(self.mf.make_rdm1())
+
+        for get_jk in (integrals.get_j, integrals.get_k):
+            vj1 = get_jk(dm, basis="ao")
+            vj2 = get_jk(2.0 * dm, basis="ao")
+            self.assertIsNot(vj1, vj2)
+            np.testing.assert_allclose(2.0 * vj1, vj2, atol=1e-10)
+
+    def test_gf_to_mo_energy(self):
+        kgw = KGW(self.mf)
+        rng = np.random.default_rng(1)
+
+        gf = []
+        for k in range(kgw.nkpts):
+            naux = kgw.nmo + 2 * k
+            energy = rng.standard_normal(naux)
+            coupling = rng.standard_normal((kgw.nmo, naux)) + 1.0j * rng.standard_normal(
+                (kgw.nmo, naux)
+            )
+            gf.append(GreensFunction(energy, coupling))
+
+        mo_energy = kgw._gf_to_mo_energy(gf)
+
+        for k in range(kgw.nkpts):
+            for i in range(kgw.nmo):
+                arg = np.argmax(np.abs(gf[k].coupling[i]) ** 2)
+                self.assertAlmostEqual(mo_energy[k][i], gf[k].energy[arg], 12)
+
+    def test_sr_cache(self):
+        kgw = KGW(self.mf)
+        integrals = kgw.ao2mo(transform=False)
+        self.assertEqual(len(integrals._sr_cache), 0)
+
+        for ki, kj in [(0, 1), (0, 1), (2, 3)]:
+            blocks = list(integrals._sr_loop(ki, kj))
+            b1 = 0
+            for block in self.mf.with_df.sr_loop((ki, kj), compact=False):
+                b0, b1 = b1, b1 + block[0].shape[0]
+                ref = (block[0] + block[1] * 1.0j).reshape(-1, *blocks[0].shape[1:])
+                np.testing.assert_allclose(np.concatenate(blocks)[b0:b1], ref, atol=1e-12)
+        self.assertEqual(list(integrals._sr_cache), [(0, 1), (2, 3)])
+
+        # The blocks loaded by `transform` are reused by `get_j` and
+        # `get_k`, until the coefficients are updated
+        dm = np.array(self.mf.make_rdm1())
+        with mock.patch.object(
+            self.mf.with_df, "sr_loop", wraps=self.mf.with_df.sr_loop
+        ) as sr_loop:
+            integrals.transform()
+            self.assertEqual(sr_loop.call_count, len(self.kpts) ** 2 - 2)
+            integrals.get_j(dm, basis="ao")
+            integrals.get_k(dm, basis="ao")
+            self.assertEqual(sr_loop.call_count, len(self.kpts) ** 2 - 2)
+            integrals.update_coeffs(mo_coeff_g=self.mf.mo_coeff)
+            self.assertEqual(sr_loop.call_count, len(self.kpts) ** 2 * 2 - 2)
+
+    def test_store_full_precision(self):
+        dm = np.array(self.mf.make_rdm1())
+        dm = np.einsum("kpq,kpi,kqj->kij", dm, np.conj(self.mf.mo_coeff), self.mf.mo_coeff)
+
+        vjk = {}
+        for precision in ("single", "double"):
+            kgw = KGW(self.mf, fock_loop=True, store_full_precision=precision)
+            integrals = kgw.ao2mo()
+            self.assertEqual(integrals.Lpq[0, 0].dtype, integrals.dtype_full)
+            vjk[precision] = (integrals.get_j(dm), integrals.get_k(dm))
+
+        for v1, v2 in zip(vjk["single"], vjk["double"]):
+            np.testing.assert_allclose(v1, v2, atol=1e-6 * np.max(np.abs(v2)))
+
+    def test_dtda_compression(self):
+        nmom_max = 3
+
+        th1, tp1 = self._get_moments(nmom_max, compression=None)
+        th2, tp2 = self._get_moments(nmom_max, compression="ia")
+
+        np.testing.assert_allclose(th1, th2, atol=1e-8 * np.max(np.abs(th1)))
+        np.testing.assert_allclose(tp1, tp2, atol=1e-8 * np.max(np.abs(tp1)))
+
+        # Every q-point is its own inverse on this mesh, so the
+        # rotations are real
+        integrals = KGW(self.mf, compression="ia").ao2mo(transform=False)
+        for rot in integrals.get_compression_metric():
+            self.assertIsNotNone(rot)
+            np.testing.assert_allclose(rot.imag, 0.0, atol=1e-12)
+
+    def test_moment_dtype(self):
+        nmom_max = 3
+
+        th1, tp1 = self._get_moments(nmom_max)
+        th2, tp2 = self._get_moments(nmom_max, moment_dtype=np.complex64)
+
+        self.assertEqual(th2.dtype, np.complex128)
+        self.assertEqual(tp2.dtype, np.complex128)
+        np.testing.assert_allclose(th1, th2, atol=1e-5 * np.max(np.abs(th1)))
+        np.testing.assert_allclose(tp1, tp2, atol=1e-5 * np.max(np.abs(tp1)))
+
 
 if __name__ == "__main__":
     print("Running tests for KGW")
@@ -0,0 +1,62 @@
+"""
+Tests for `pbc/kpts.py`
+"""
+
+import itertools
+import unittest
+
+import numpy as np
+from pyscf.pbc import gto
+
+from momentGW.pbc.kpts import KPoints
+
+
+class Test_KPoints(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cell = gto.Cell()
+        cell.atom = "He 0 0 0; He 1 1 1"
+        cell.basis = "6-31g"
+        cell.a = np.eye(3) * 3
+        cell.verbose = 0
+        cell.build()
+
+        kpts = cell.make_kpts([3, 2, 1])
+
+        cls.cell, cls.kpts = cell, kpts
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.cell, cls.kpts
+
+    def test_kconserv(self):
+        kpts = KPoints(self.cell, self.kpts)
+
+        for ki, kj in itertools.product(range(len(kpts)), repeat=2):
+            kk = kpts.member(kpts.wrap_around(kpts[ki] + kpts[kj]))
+            self.assertEqual(kpts.kconserv_sum[ki, kj], kk)
+            kk = kpts.member(kpts.wrap_around(kpts[ki] - kpts[kj]))
+            self.assertEqual(kpts.kconserv_diff[ki, kj], kk)
+
+    def test_loop(self):
+        kpts = KPoints(self.cell, self.kpts)
+        nk = len(kpts)
+
+        for depth in (1, 2, 3):
+            if depth == 1:
+                ref = list(range(nk))
+            else:
+                ref = list(itertools.product(range(nk), repeat=depth))
+            self.assertEqual(list(kpts.loop(depth)), ref)
+            self.assertEqual(list(kpts.loop(depth)), ref)
+
+        # Nested loops over the same cached combinations
+        pairs = [(ki, kj) for ki in kpts.loop(1) for kj in kpts.loop(1)]
+        self.assertEqual(pairs, list(itertools.product(range(nk), repeat=2)))
+
+        self.assertEqual(len(list(kpts.loop(1, mpi=True))), kpts.loop_size())
+
+
+if __name__ == "__main__":
+    print("Running tests for KPoints")
+    unittest.main()
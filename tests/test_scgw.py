@@ -12,6 +12,11 @@ from pyscf.agf2 import mpi_helper
 from momentGW import scGW
 
 
+def _bcast_mo(mf):
+    """Broadcast the MOs of a mean-field from the root process."""
+    mf.mo_coeff, mf.mo_energy = mpi_helper.bcast_dict((mf.mo_coeff, mf.mo_energy), root=0)
+
+
 class Test_scGW(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -23,10 +28,9 @@ class Test_scGW(unittest.TestCase):
 
         mf = dft.RKS(mol)
         mf.xc = "hf"
-        mf.conv_tol = 1e-11
+        mf.conv_tol = 1e-9
         mf.kernel()
-        mf.mo_coeff = mpi_helper.bcast_dict(mf.mo_coeff, root=0)
-        mf.mo_energy = mpi_helper.bcast_dict(mf.mo_energy, root=0)
+        _bcast_mo(mf)
 
         mf = mf.density_fit(auxbasis="cc-pv5z-ri")
         mf.with_df.build()
@@ -37,38 +41,54 @@ class Test_scGW(unittest.TestCase):
     def tearDownClass(cls):
         del cls.mol, cls.mf
 
-    def test_nelec(self):
-        gw = scGW(self.mf)
+    def _test_nelec(self, places, **kwargs):
+        gw = scGW(self.mf, **kwargs)
         gw.diagonal_se = True
         gw.vhf_df = False
         conv, gf, se, _ = gw.kernel(nmom_max=1)
         self.assertAlmostEqual(
             gf.make_rdm1().trace(),
             self.mol.nelectron,
-            1,
-        )
-        gw.optimise_chempot = True
-        gw.vhf_df = False
-        conv, gf, se, _ = gw.kernel(nmom_max=1)
-        self.assertAlmostEqual(
-            gf.make_rdm1().trace(),
-            self.mol.nelectron,
-            8,
-        )
-        gw.fock_loop = True
-        gw.vhf_df = False
-        conv, gf, se, _ = gw.kernel(nmom_max=1)
-        self.assertAlmostEqual(
-            gf.make_rdm1().trace(),
-            self.mol.nelectron,
-            8,
+            places,
         )
 
+    def test_nelec(self):
+        self._test_nelec(1)
+
+    def test_nelec_optimise_chempot(self):
+        self._test_nelec(8, optimise_chempot=True)
+
+    def test_nelec_fock_loop(self):
+        self._test_nelec(8, optimise_chempot=True, fock_loop=True)
+
+
+class Test_scGW_regression(unittest.TestCase):
+    # The regression tests do not use the mean-field of `Test_scGW`, and
+    # are kept separate so that they can run on a different worker
+    # (e.g. with `pytest -n auto --dist loadscope`) without building it.
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mfs = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.mfs
+
+    @classmethod
+    def _get_ref_mf(cls, xc):
+        """Get the reference mean-field for `xc`, shared between tests."""
+        if xc not in cls.mfs:
+            mol = gto.M(atom="H 0 0 0; Li 0 0 1.64", basis="6-31g", verbose=0)
+            mf = dft.RKS(mol, xc=xc).density_fit()
+            mf.conv_tol = 1e-9
+            mf.kernel()
+            _bcast_mo(mf)
+            cls.mfs[xc] = mf
+        return cls.mfs[xc]
+
     def _test_regression(self, xc, kwargs, nmom_max, ip, ea, name=""):
-        mol = gto.M(atom="H 0 0 0; Li 0 0 1.64", basis="6-31g", verbose=0)
-        mf = dft.RKS(mol, xc=xc).density_fit().run()
-        mf.mo_coeff = mpi_helper.bcast_dict(mf.mo_coeff, root=0)
-        mf.mo_energy = mpi_helper.bcast_dict(mf.mo_energy, root=0)
+        mf = self._get_ref_mf(xc)
         gw = scGW(mf, **kwargs)
         gw.conv_tol = 1e-9
         gw.max_cycle = 200
@@ -2,17 +2,23 @@
 Tests for `thc.py`.
 """
 
+import tempfile
 import unittest
 from os.path import abspath, dirname, join
 
+import h5py
 import numpy as np
 import pytest
 from pyscf import lib
 from pyscf.agf2 import mpi_helper
-from pyscf.pbc import dft, gto
+from pyscf.pbc import dft, gto, tools
+from pyscf.pbc.df import FFTDF
 from scipy.linalg import cholesky
 
 from momentGW.gw import GW
+from momentGW.pbc.gw import KGW
+from momentGW.pbc.ints import KIntegrals
+from momentGW.pbc.kpts import KPoints
 
 
 class Test_THCTDA(unittest.TestCase):
@@ -123,6 +129,91 @@ class Test_THCTDA(unittest.TestCase):
             dif = np.max(np.abs(a - b)) / np.max(np.abs(a))
             self.assertAlmostEqual(dif, 0, 8)
 
+    def test_jk_vs_kgw(self):
+        file_path = abspath(join(dirname(__file__), "..", "tests/thc.h5"))
+
+        gw = GW(self.kmf)
+        gw.thc_opts = dict(file_path=file_path)
+        gw.polarizability = "thc-dtda"
+        integrals = gw.ao2mo()
+
+        kmf = dft.KRKS(self.cell, self.cell.make_kpts([1, 1, 1]), xc="pbe")
+        kmf = kmf.density_fit()
+        kmf.exxdiv = None
+        kmf.mo_coeff = self.kmf.mo_coeff[None]
+        kmf.mo_energy = self.kmf.mo_energy[None]
+        kmf.mo_occ = self.kmf.mo_occ[None]
+
+        kgw = KGW(kmf)
+        kgw.thc_opts = dict(file_path=file_path)
+        kgw.polarizability = "dtda"
+        self.assertIs(kgw.ao2mo(transform=False).file_path, None)
+        kgw.polarizability = "thc-dtda"
+        kintegrals = kgw.ao2mo()
+
+        dm = self.kmf.make_rdm1()
+        np.testing.assert_allclose(
+            integrals.get_j(dm, basis="ao"),
+            kintegrals.get_j(dm[None], basis="ao")[0],
+            atol=1e-10,
+        )
+        np.testing.assert_allclose(
+            integrals.get_k(dm, basis="ao"),
+            kintegrals.get_k(dm[None], basis="ao")[0],
+            atol=1e-10,
+        )
+
+    def test_jk_kpts_vs_fftdf(self):
+        # Build an exact THC factorisation on the uniform grid, such
+        # that the J and K matrices match those of FFTDF
+        cell = gto.Cell()
+        cell.a = np.eye(3) * 3
+        cell.atom = """He 0 0 0; He 1 0.5 1"""
+        cell.basis = "6-31g"
+        cell.mesh = [9, 9, 9]
+        cell.verbose = 0
+        cell.build()
+
+        kpts = KPoints(cell, cell.make_kpts([3, 1, 1]))
+        kmf = dft.KRKS(cell, kpts._kpts, xc="hf")
+        kmf.exxdiv = None
+        mo_energy, mo_coeff = kmf.eig(kmf.get_hcore(), kmf.get_ovlp())
+        mo_occ = kmf.get_occ(mo_energy, mo_coeff)
+        dm = kmf.make_rdm1(mo_coeff, mo_occ)
+
+        coords = cell.gen_uniform_grids(cell.mesh)
+        weight = cell.vol / len(coords)
+        coll = np.array(cell.pbc_eval_gto("GTOval", coords, kpts=kpts._kpts)).swapaxes(1, 2)
+        cou = []
+        for q in kpts:
+            coulG = tools.get_coulG(cell, k=q, mesh=cell.mesh, exxdiv=None)
+            phase = np.exp(-1j * np.dot(coords, (cell.get_Gv(cell.mesh) + q).T))
+            cou.append(np.dot(phase * coulG, phase.T.conj()) * weight**2 / cell.vol)
+        cou = np.array(cou)
+
+        # Store the q-points in a different order to the k-points
+        perm = [2, 0, 1]
+
+        with tempfile.NamedTemporaryFile(suffix=".h5") as f:
+            with h5py.File(f.name, "w") as thc_eri:
+                thc_eri["collocation_matrix"] = np.stack([coll.real, coll.imag], axis=-1)
+                thc_eri["coulomb_matrix"] = np.stack([cou[perm].real, cou[perm].imag], axis=-1)
+                thc_eri["kpts"] = kpts._kpts
+                thc_eri["qpts"] = kpts._kpts[perm]
+
+            integrals = KIntegrals(kmf.with_df, kpts, mo_coeff, mo_occ, file_path=f.name)
+            integrals.import_thc()
+
+        vj, vk = FFTDF(cell, kpts._kpts).get_jk(dm, kpts=kpts._kpts, exxdiv=None)
+        self.assertGreater(np.max(np.abs(vk.imag)), 1e-2)
+
+        np.testing.assert_allclose(integrals.get_j(dm, basis="ao"), vj, atol=1e-7)
+        np.testing.assert_allclose(integrals.get_k(dm, basis="ao"), vk, atol=1e-7)
+
+        dm = np.array([np.diag(o) for o in mo_occ])
+        vk = lib.einsum("kpq,kpi,kqj->kij", vk, np.conj(mo_coeff), mo_coeff)
+        np.testing.assert_allclose(integrals.get_k(dm), vk, atol=1e-7)
+
     def _test_regression(self, xc, kwargs, nmom_max, ip, ea, name=""):
         cell = gto.M()
         cell.a = np.eye(3) * 3